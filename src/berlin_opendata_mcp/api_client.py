@@ -5,9 +5,12 @@ Supported APIs:
 - CKAN (datenregister.berlin.de) – Open Data catalog
 """
 
+import asyncio
+import time
 from typing import Any, Optional
 
 import httpx
+import orjson
 
 # ─── Constants ────────────────────────────────────────────────────────────────
 
@@ -16,6 +19,20 @@ CKAN_API_URL = f"{CKAN_BASE_URL}/api/3/action"
 PORTAL_URL = "https://daten.berlin.de"
 
 REQUEST_TIMEOUT = 30.0
+# Upper bound for simultaneous requests over the shared client (CKAN actions and http_get_json)
+MAX_CONCURRENT_REQUESTS = 8
+CACHE_TTL = 300.0
+# Entry count, not bytes: a package_search with rows=50 (full resources and
+# extras) can take several hundred kB, so the worst case is roughly
+# CACHE_MAXSIZE x 0.5 MB (~64 MB) – sized for small instances like Render's free plan.
+CACHE_MAXSIZE = 128
+# Rarely changing lookups are cached for longer than regular queries
+CACHE_TTL_BY_ACTION = {
+    "group_list": 3600.0,
+    "tag_list": 3600.0,
+}
+# Responses larger than this are parsed in a worker thread to keep the event loop responsive
+THREADED_PARSE_BYTES = 256_000
 USER_AGENT = "BerlinOpenDataMCP/0.1 (MCP Server; +https://github.com/tifa365/berlin-opendata-mcp)"
 
 BERLIN_GROUPS = [
@@ -45,100 +62,257 @@ BERLIN_GROUPS = [
     "wirtschaft",
     "wohnen",
 ]
+BERLIN_GROUPS_SET = frozenset(BERLIN_GROUPS)
+BERLIN_GROUPS_STR = ", ".join(BERLIN_GROUPS)
 
 
 # ─── HTTP Client ──────────────────────────────────────────────────────────────
 
 
-async def _get_client() -> httpx.AsyncClient:
-    """Create a configured async HTTP client."""
-    return httpx.AsyncClient(
-        timeout=REQUEST_TIMEOUT,
-        headers={"User-Agent": USER_AGENT},
-        follow_redirects=True,
-    )
+_client: Optional[httpx.AsyncClient] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+_request_slots: Optional[asyncio.Semaphore] = None
+
+
+async def get_client() -> httpx.AsyncClient:
+    """Return the shared async HTTP client, creating it on first use.
+
+    The client keeps connections alive across requests and speaks HTTP/2,
+    so only the first call to datenregister.berlin.de pays for the TCP/TLS
+    handshake and concurrent requests share one connection. A new
+    client is created if the previous one was closed or belongs to another
+    event loop (e.g. between test runs). A client left behind on another
+    loop cannot be closed from here and is only dropped, so callers that
+    run several event loops should call close_client() before each loop ends.
+    """
+    global _client, _client_loop, _request_slots
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        _client = httpx.AsyncClient(
+            timeout=REQUEST_TIMEOUT,
+            headers={"User-Agent": USER_AGENT, "Accept-Encoding": "gzip, br, zstd"},
+            follow_redirects=True,
+            http2=True,
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+        )
+        _client_loop = loop
+        _request_slots = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+    return _client
+
+
+async def close_client() -> None:
+    """Close the shared HTTP client and release its connections."""
+    global _client, _client_loop, _request_slots
+    if _client is not None:
+        await _client.aclose()
+    _client = None
+    _client_loop = None
+    _request_slots = None
+
+
+async def _parse_json(raw: bytes) -> Any:
+    """Parse a JSON body, offloading large payloads to a worker thread."""
+    if len(raw) > THREADED_PARSE_BYTES:
+        return await asyncio.to_thread(orjson.loads, raw)
+    return orjson.loads(raw)
+
+
+# ─── Response Cache ───────────────────────────────────────────────────────────
 
+_cache: dict[tuple, tuple[float, Any]] = {}
+_pending: dict[tuple, asyncio.Task] = {}
 
-async def ckan_request(action: str, params: Optional[dict[str, Any]] = None) -> dict[str, Any]:
+
+def _cache_key(action: str, params: Optional[dict[str, Any]]) -> Optional[tuple]:
+    """Build a hashable cache key from an action name and its query parameters.
+
+    List values (repeated query parameters) are frozen into tuples. Returns
+    None if the parameters still cannot be hashed; such requests are not cached.
+    """
+    if not params:
+        return (action, ())
+    key = (action, tuple(sorted((k, tuple(v) if isinstance(v, list) else v) for k, v in params.items())))
+    try:
+        hash(key)
+    except TypeError:
+        return None
+    return key
+
+
+def clear_cache() -> None:
+    """Drop all cached CKAN responses."""
+    _cache.clear()
+
+
+async def ckan_request(
+    action: str,
+    params: Optional[dict[str, Any]] = None,
+    bypass_cache: bool = False,
+) -> dict[str, Any]:
     """Make a CKAN API request and return the result.
 
+    Successful results are cached in-process for CACHE_TTL seconds (or the
+    per-action override in CACHE_TTL_BY_ACTION), keyed by action and
+    parameters. Identical requests that arrive while one is already in
+    flight share its response instead of hitting CKAN again.
+
+    Cached results are shared by reference between callers and must be
+    treated as read-only; copy them before modifying.
+
     Args:
         action: CKAN API action name (e.g. 'package_search')
         params: Query parameters
+        bypass_cache: Skip the cache lookup and always query CKAN (the fresh
+            result is still stored)
 
     Returns:
-        The 'result' field from the CKAN response
+        The 'result' field from the CKAN response (shared, do not mutate)
 
     Raises:
         RuntimeError: If the CKAN API returns an error
     """
-    async with await _get_client() as client:
-        url = f"{CKAN_API_URL}/{action}"
-        response = await client.get(url, params=params or {})
+    key = _cache_key(action, params)
+    if key is None:
+        return await _ckan_fetch(action, params)
+    if not bypass_cache:
+        cached = _cache.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+
+    task = _pending.get(key)
+    if task is None:
+        task = asyncio.ensure_future(_fetch_and_cache(key, action, params))
+        _pending[key] = task
+        task.add_done_callback(lambda t: _on_fetch_done(key, t))
+    # Shield the shared request so one cancelled caller does not abort it for the others
+    return await asyncio.shield(task)
+
+
+async def ckan_batch(
+    calls: list[tuple[str, Optional[dict[str, Any]]]],
+    return_exceptions: bool = False,
+) -> list[Any]:
+    """Run several CKAN requests concurrently.
+
+    Args:
+        calls: (action, params) pairs
+        return_exceptions: Return exceptions in place of failed results
+            instead of raising the first one
+
+    Returns:
+        Results in the same order as ``calls``
+    """
+    return await asyncio.gather(
+        *(ckan_request(action, params) for action, params in calls),
+        return_exceptions=return_exceptions,
+    )
+
+
+def _on_fetch_done(key: tuple, task: asyncio.Task) -> None:
+    """Unregister a finished shared request.
+
+    Reading the exception marks it as retrieved, so a failure whose callers
+    were all cancelled does not log "Task exception was never retrieved".
+    """
+    _pending.pop(key, None)
+    if not task.cancelled():
+        task.exception()
+
+
+async def _fetch_and_cache(key: tuple, action: str, params: Optional[dict[str, Any]]) -> dict[str, Any]:
+    """Fetch a CKAN result and store it in the response cache."""
+    result = await _ckan_fetch(action, params)
+
+    _cache.pop(key, None)
+    if len(_cache) >= CACHE_MAXSIZE:
+        del _cache[next(iter(_cache))]
+    _cache[key] = (time.monotonic() + CACHE_TTL_BY_ACTION.get(action, CACHE_TTL), result)
+    return result
+
+
+async def _ckan_fetch(action: str, params: Optional[dict[str, Any]] = None) -> dict[str, Any]:
+    """Query the CKAN API without caching and return the 'result' field.
+
+    At most MAX_CONCURRENT_REQUESTS calls are sent to CKAN at the same time.
+    """
+    client = await get_client()
+    url = f"{CKAN_API_URL}/{action}"
+    async with _request_slots:
+        response = await client.get(url, params=params)
+    if response.status_code >= 400:
         response.raise_for_status()
-        data = response.json()
+    data = await _parse_json(response.content)
 
-        if not data.get("success"):
-            error_msg = data.get("error", {}).get("message", "Unknown CKAN error")
-            raise RuntimeError(f"CKAN API error: {error_msg}")
+    if not data.get("success"):
+        error_msg = data.get("error", {}).get("message", "Unknown CKAN error")
+        raise RuntimeError(f"CKAN API error: {error_msg}")
 
-        return data["result"]
+    return data["result"]
 
 
 async def http_get_json(url: str, params: Optional[dict[str, Any]] = None) -> Any:
-    """Generic JSON GET request."""
-    async with await _get_client() as client:
-        response = await client.get(url, params=params or {})
+    """Generic JSON GET request, subject to the same concurrency limit as CKAN calls."""
+    client = await get_client()
+    async with _request_slots:
+        response = await client.get(url, params=params)
+    if response.status_code >= 400:
         response.raise_for_status()
-        return response.json()
+    return await _parse_json(response.content)
 
 
 # ─── Formatting Helpers ───────────────────────────────────────────────────────
 
 
-def format_dataset_summary(dataset: dict[str, Any]) -> str:
-    """Format a CKAN dataset into a readable Markdown summary."""
-    title = dataset.get("title", "Unbekannt")
-    name = dataset.get("name", "")
-    author = dataset.get("author", "Unbekannt")
-    notes = (dataset.get("notes") or "")[:300]
-    license_title = dataset.get("license_title", "Unbekannt")
-    num_resources = dataset.get("num_resources", 0)
-    modified = dataset.get("metadata_modified", "")[:10]
-    groups = [g.get("title", g.get("name", "")) for g in dataset.get("groups", [])]
-    tags = [t.get("display_name", t.get("name", "")) for t in dataset.get("tags", [])]
+def parse_extras(dataset: dict[str, Any]) -> dict[str, Any]:
+    """Turn a CKAN dataset's 'extras' list into a key/value dict, skipping entries without a key."""
+    return {e.get("key"): e.get("value") for e in dataset.get("extras", []) if "key" in e}
+
+
+def format_dataset_summary(dataset: dict[str, Any], extras: Optional[dict[str, Any]] = None) -> str:
+    """Format a CKAN dataset into a readable Markdown summary.
+
+    Args:
+        dataset: CKAN package dict
+        extras: Pre-parsed extras (see parse_extras); parsed from the dataset if omitted
+    """
+    get = dataset.get
+    title = get("title", "Unbekannt")
+    name = get("name", "")
+    author = get("author", "Unbekannt")
+    notes = (get("notes") or "")[:300]
+    license_title = get("license_title", "Unbekannt")
+    num_resources = get("num_resources", 0)
+    modified = get("metadata_modified", "")[:10]
+    groups = [g.get("title") or g.get("name") or "" for g in get("groups", [])]
+    tags = [t.get("display_name") or t.get("name") or "" for t in get("tags", [])[:10]]
 
     # Berlin-specific extras
-    extras = {e["key"]: e["value"] for e in dataset.get("extras", [])}
+    if extras is None:
+        extras = parse_extras(dataset)
     berlin_type = extras.get("berlin_type", "")
     geo_coverage = extras.get("geographical_coverage", "")
     date_updated = extras.get("date_updated", "")
 
-    url = f"{PORTAL_URL}/datensaetze/{name}"
-
-    lines = [
-        f"### {title}",
-        f"- **ID**: `{name}`",
-        f"- **Autor**: {author}",
-        f"- **Lizenz**: {license_title}",
-        f"- **Ressourcen**: {num_resources}",
-        f"- **Letzte Aenderung**: {modified}",
-    ]
-    if berlin_type:
-        lines.append(f"- **Typ**: {berlin_type}")
-    if date_updated:
-        lines.append(f"- **Daten aktualisiert**: {date_updated}")
-    if geo_coverage:
-        lines.append(f"- **Raeumliche Abdeckung**: {geo_coverage}")
-    if groups:
-        lines.append(f"- **Kategorien**: {', '.join(groups)}")
-    if tags:
-        lines.append(f"- **Tags**: {', '.join(tags[:10])}")
-    if notes:
-        lines.append(f"- **Beschreibung**: {notes}...")
-    lines.append(f"- **URL**: {url}")
-
-    return "\n".join(lines)
+    optional = (
+        (berlin_type, f"\n- **Typ**: {berlin_type}"),
+        (date_updated, f"\n- **Daten aktualisiert**: {date_updated}"),
+        (geo_coverage, f"\n- **Raeumliche Abdeckung**: {geo_coverage}"),
+        (groups, f"\n- **Kategorien**: {', '.join(groups)}"),
+        (tags, f"\n- **Tags**: {', '.join(tags)}"),
+        (notes, f"\n- **Beschreibung**: {notes}..."),
+    )
+    extras_str = "".join(tmpl for cond, tmpl in optional if cond)
+
+    return (
+        f"### {title}\n"
+        f"- **ID**: `{name}`\n"
+        f"- **Autor**: {author}\n"
+        f"- **Lizenz**: {license_title}\n"
+        f"- **Ressourcen**: {num_resources}\n"
+        f"- **Letzte Aenderung**: {modified}"
+        f"{extras_str}\n"
+        f"- **URL**: {PORTAL_URL}/datensaetze/{name}"
+    )
 
 
 def format_resource_info(resource: dict[str, Any]) -> str:
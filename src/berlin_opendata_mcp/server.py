@@ -5,35 +5,90 @@ MCP Server fuer den Zugriff auf Open Data des Landes Berlin.
 Integriert CKAN (datenregister.berlin.de) fuer 2500+ Datensaetze.
 """
 
-import json
+import asyncio
 import os
-from typing import Optional
+from operator import itemgetter
+from typing import TYPE_CHECKING, Any, Callable, Optional
 
-from mcp.server.fastmcp import FastMCP
-from pydantic import BaseModel, ConfigDict, Field
+import orjson
+from pydantic import BaseModel, ConfigDict, Field, field_validator
 
 from .api_client import (
-    BERLIN_GROUPS,
+    BERLIN_GROUPS_SET,
+    BERLIN_GROUPS_STR,
     PORTAL_URL,
     ckan_request,
+    close_client,
     format_dataset_summary,
     format_resource_info,
     handle_api_error,
+    parse_extras,
 )
 
+if TYPE_CHECKING:
+    from mcp.server.fastmcp import FastMCP
+
 # ─── Server Setup ─────────────────────────────────────────────────────────────
 
-mcp = FastMCP(
-    "berlin_opendata_mcp",
-    instructions=(
-        "MCP Server fuer Open Data des Landes Berlin. "
-        "Bietet Zugriff auf 2500+ Datensaetze via CKAN API (datenregister.berlin.de). "
-        "Kategorien: Arbeit, Bildung, Demographie, Gesundheit, Kultur, "
-        "Umwelt, Verkehr, Verwaltung, Wirtschaft, Wohnen u.v.m. "
-        "Daten unter verschiedenen offenen Lizenzen (CC0, CC-BY, dl-de-zero-2.0, dl-de-by-2.0)."
-    ),
-    host=os.environ.get("MCP_HOST", "0.0.0.0"),
-    port=int(os.environ.get("PORT", "8000")),
+# Tools and resources are collected here and only attached to a FastMCP
+# instance in create_server(), so importing this module (e.g. from the
+# tests) does not pull in or start the MCP server.
+_TOOLS: list[tuple[Callable[..., Any], dict[str, Any]]] = []
+_RESOURCES: list[tuple[Callable[..., Any], str]] = []
+
+
+def _tool(**kwargs: Any) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Mark a function as MCP tool; arguments are passed to FastMCP.tool()."""
+
+    def decorator(fn: Callable[..., Any]) -> Callable[..., Any]:
+        _TOOLS.append((fn, kwargs))
+        return fn
+
+    return decorator
+
+
+def _resource(uri: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Mark a function as MCP resource served under the given URI template."""
+
+    def decorator(fn: Callable[..., Any]) -> Callable[..., Any]:
+        _RESOURCES.append((fn, uri))
+        return fn
+
+    return decorator
+
+
+def create_server() -> "FastMCP":
+    """Create the FastMCP server and register all tools and resources."""
+    from mcp.server.fastmcp import FastMCP
+
+    mcp = FastMCP(
+        "berlin_opendata_mcp",
+        instructions=(
+            "MCP Server fuer Open Data des Landes Berlin. "
+            "Bietet Zugriff auf 2500+ Datensaetze via CKAN API (datenregister.berlin.de). "
+            "Kategorien: Arbeit, Bildung, Demographie, Gesundheit, Kultur, "
+            "Umwelt, Verkehr, Verwaltung, Wirtschaft, Wohnen u.v.m. "
+            "Daten unter verschiedenen offenen Lizenzen (CC0, CC-BY, dl-de-zero-2.0, dl-de-by-2.0)."
+        ),
+        host=os.environ.get("MCP_HOST", "0.0.0.0"),
+        port=int(os.environ.get("PORT", "8000")),
+    )
+    for fn, kwargs in _TOOLS:
+        mcp.tool(**kwargs)(fn)
+    for fn, uri in _RESOURCES:
+        mcp.resource(uri)(fn)
+    return mcp
+
+
+# ─── Report Templates ─────────────────────────────────────────────────────────
+
+_SEARCH_HEADER = "## Suchergebnis: {total} Datensaetze fuer '{query}'\nZeige {shown} von {total} (Offset: {offset})\n"
+_ANALYZE_HEADER = "## Analyse: '{query}'\n**{total} Datensaetze gefunden**, Top {shown} analysiert:\n"
+_STATS_HEADER = (
+    "## Open Data Katalog – Land Berlin\n"
+    "**Gesamtzahl Datensaetze**: {total}\n\n"
+    f"**Portal**: {PORTAL_URL}\n"
+    "**Lizenzen**: CC0, CC-BY, Datenlizenz Deutschland (Zero/Namensnennung), GeoNutzV u.a.\n"
 )
 
 
@@ -42,6 +97,19 @@ mcp = FastMCP(
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 
 
+def _validate_group(v: Optional[str]) -> Optional[str]:
+    """Reject unknown category IDs before they reach CKAN; empty values mean "no category".
+
+    IDs are matched case-insensitively, e.g. 'Bildung' is accepted as 'bildung'.
+    """
+    if not v:
+        return None
+    v = v.lower()
+    if v not in BERLIN_GROUPS_SET:
+        raise ValueError(f"Unbekannte Kategorie '{v}'. Verfuegbar: {BERLIN_GROUPS_STR}")
+    return v
+
+
 class SearchDatasetsInput(BaseModel):
     """Input fuer die Datensatz-Suche."""
 
@@ -62,11 +130,16 @@ class SearchDatasetsInput(BaseModel):
     )
     filter_group: Optional[str] = Field(
         default=None,
-        description=f"Nach Kategorie filtern. Verfuegbar: {', '.join(BERLIN_GROUPS)}",
+        description=f"Nach Kategorie filtern. Verfuegbar: {BERLIN_GROUPS_STR}",
     )
 
+    @field_validator("filter_group")
+    @classmethod
+    def _check_group(cls, v: Optional[str]) -> Optional[str]:
+        return _validate_group(v)
 
-@mcp.tool(
+
+@_tool(
     name="berlin_search_datasets",
     annotations={
         "title": "Datensaetze suchen",
@@ -103,18 +176,13 @@ async def berlin_search_datasets(params: SearchDatasetsInput) -> str:
         if not datasets:
             return f"Keine Datensaetze gefunden fuer '{params.query}'."
 
-        lines = [
-            f"## Suchergebnis: {total} Datensaetze fuer '{params.query}'",
-            f"Zeige {len(datasets)} von {total} (Offset: {params.offset})\n",
-        ]
-        for ds in datasets:
-            lines.append(format_dataset_summary(ds))
-            lines.append("")
+        header = _SEARCH_HEADER.format(total=total, query=params.query, shown=len(datasets), offset=params.offset)
+        output = f"{header}\n" + "\n\n".join(map(format_dataset_summary, datasets)) + "\n"
 
         if total > params.offset + len(datasets):
-            lines.append(f"*→ Weitere Ergebnisse mit offset={params.offset + len(datasets)}*")
+            output += f"\n*→ Weitere Ergebnisse mit offset={params.offset + len(datasets)}*"
 
-        return "\n".join(lines)
+        return output
 
     except Exception as e:
         return handle_api_error(e, "Datensatzsuche")
@@ -132,7 +200,7 @@ class GetDatasetInput(BaseModel):
     )
 
 
-@mcp.tool(
+@_tool(
     name="berlin_get_dataset",
     annotations={
         "title": "Datensatz-Details abrufen",
@@ -153,13 +221,13 @@ async def berlin_get_dataset(params: GetDatasetInput) -> str:
     """
     try:
         result = await ckan_request("package_show", {"id": params.dataset_id})
+        extras = parse_extras(result)
 
-        lines = [format_dataset_summary(result), "\n#### Ressourcen / Downloads\n"]
+        lines = [format_dataset_summary(result, extras=extras), "\n#### Ressourcen / Downloads\n"]
         for res in result.get("resources", []):
             lines.append(format_resource_info(res))
 
         # Extra metadata
-        extras = {e["key"]: e["value"] for e in result.get("extras", [])}
         if extras:
             lines.append("\n#### Zusaetzliche Metadaten")
             for k, v in extras.items():
@@ -184,12 +252,17 @@ class ListGroupInput(BaseModel):
 
     group_id: Optional[str] = Field(
         default=None,
-        description=f"Gruppen-ID fuer Details. Verfuegbar: {', '.join(BERLIN_GROUPS)}. "
+        description=f"Gruppen-ID fuer Details. Verfuegbar: {BERLIN_GROUPS_STR}. "
         "Wenn leer, werden alle Kategorien aufgelistet.",
     )
 
+    @field_validator("group_id")
+    @classmethod
+    def _check_group(cls, v: Optional[str]) -> Optional[str]:
+        return _validate_group(v)
 
-@mcp.tool(
+
+@_tool(
     name="berlin_list_categories",
     annotations={
         "title": "Datenkategorien auflisten",
@@ -249,7 +322,7 @@ class TagSearchInput(BaseModel):
     limit: int = Field(default=30, description="Maximale Anzahl Tags", ge=1, le=100)
 
 
-@mcp.tool(
+@_tool(
     name="berlin_list_tags",
     annotations={
         "title": "Tags durchsuchen",
@@ -310,7 +383,7 @@ class AnalyzeDatasetInput(BaseModel):
     include_freshness: bool = Field(default=True, description="Aktualitaets-Analyse einschliessen")
 
 
-@mcp.tool(
+@_tool(
     name="berlin_analyze_datasets",
     annotations={
         "title": "Datensaetze analysieren",
@@ -348,52 +421,62 @@ async def berlin_analyze_datasets(params: AnalyzeDatasetInput) -> str:
         if not datasets:
             return f"Keine Datensaetze gefunden fuer '{params.query}'."
 
-        lines = [
-            f"## Analyse: '{params.query}'",
-            f"**{total} Datensaetze gefunden**, Top {len(datasets)} analysiert:\n",
-        ]
-
+        blocks = []
         for i, ds in enumerate(datasets, 1):
-            name = ds.get("name", "")
-            title = ds.get("title", "?")
-            modified = ds.get("metadata_modified", "?")[:10]
-            resources = ds.get("resources", [])
-            formats = sorted(set(r.get("format", "?") for r in resources))
+            get = ds.get
+            name = get("name", "")
+            title = get("title", "?")
+            modified = get("metadata_modified", "?")[:10]
+            resources = get("resources", [])
+            formats = sorted({r["format"] if "format" in r else "?" for r in resources})
 
             # Berlin-specific extras
-            extras = {e["key"]: e["value"] for e in ds.get("extras", [])}
+            extras = parse_extras(ds)
             date_updated = extras.get("date_updated", "")
             geo_coverage = extras.get("geographical_coverage", "")
 
-            lines.append(f"### {i}. {title}")
-            lines.append(f"- **ID**: `{name}`")
-            lines.append(f"- **Formate**: {', '.join(formats)}")
-            lines.append(f"- **Ressourcen**: {len(resources)}")
-
-            if params.include_freshness:
-                lines.append(f"- **Letzte Aenderung**: {modified}")
-                if date_updated:
-                    lines.append(f"- **Daten aktualisiert**: {date_updated}")
-
+            resource_lines = ""
             if params.include_structure:
-                for res in resources:
-                    res_format = res.get("format", "?")
-                    res_name = res.get("name", "Unbenannt")
-                    res_url = res.get("url", "")
-                    lines.append(f"  - {res_name} ({res_format}): {res_url}")
-
-            if geo_coverage:
-                lines.append(f"- **Raeumliche Abdeckung**: {geo_coverage}")
-
-            lines.append(f"- **URL**: {PORTAL_URL}/datensaetze/{name}\n")
+                resource_lines = "".join(
+                    f"\n  - {res.get('name', 'Unbenannt')} ({res.get('format', '?')}): {res.get('url', '')}"
+                    for res in resources
+                )
+
+            optional = (
+                (params.include_freshness, f"\n- **Letzte Aenderung**: {modified}"),
+                (params.include_freshness and date_updated, f"\n- **Daten aktualisiert**: {date_updated}"),
+            )
+            optional_str = "".join(tmpl for cond, tmpl in optional if cond)
+            geo_line = f"\n- **Raeumliche Abdeckung**: {geo_coverage}" if geo_coverage else ""
+
+            blocks.append(
+                f"### {i}. {title}\n"
+                f"- **ID**: `{name}`\n"
+                f"- **Formate**: {', '.join(formats)}\n"
+                f"- **Ressourcen**: {len(resources)}"
+                f"{optional_str}{resource_lines}{geo_line}\n"
+                f"- **URL**: {PORTAL_URL}/datensaetze/{name}\n"
+            )
 
-        return "\n".join(lines)
+        header = _ANALYZE_HEADER.format(query=params.query, total=total, shown=len(datasets))
+        return f"{header}\n" + "\n".join(blocks)
 
     except Exception as e:
         return handle_api_error(e, "Datensatz-Analyse")
 
 
-@mcp.tool(
+def _sorted_facet_items(facet: Any) -> list[dict[str, Any]]:
+    """Return the items of a CKAN search facet sorted by count, highest first."""
+    if isinstance(facet, dict):
+        items = facet.get("items", [])
+    else:
+        items = facet if isinstance(facet, list) else []
+    items = [item if "count" in item else {**item, "count": 0} for item in items]
+    items.sort(key=itemgetter("count"), reverse=True)
+    return items
+
+
+@_tool(
     name="berlin_catalog_stats",
     annotations={
         "title": "Katalog-Statistiken",
@@ -425,34 +508,19 @@ async def berlin_catalog_stats() -> str:
         total = result["count"]
         facets = result.get("search_facets", result.get("facets", {}))
 
-        lines = [
-            "## Open Data Katalog – Land Berlin",
-            f"**Gesamtzahl Datensaetze**: {total}\n",
-            f"**Portal**: {PORTAL_URL}",
-            "**Lizenzen**: CC0, CC-BY, Datenlizenz Deutschland (Zero/Namensnennung), GeoNutzV u.a.\n",
-        ]
+        lines = [_STATS_HEADER.format(total=total)]
 
         # Groups
         if "groups" in facets:
             lines.append("### Kategorien")
-            groups = facets["groups"]
-            if isinstance(groups, dict):
-                items = groups.get("items", [])
-            else:
-                items = groups if isinstance(groups, list) else []
-            for item in sorted(items, key=lambda x: x.get("count", 0), reverse=True):
-                lines.append(f"- **{item.get('display_name', item.get('name', '?'))}**: {item.get('count', 0)}")
+            for item in _sorted_facet_items(facets["groups"]):
+                lines.append(f"- **{item.get('display_name') or item.get('name') or '?'}**: {item['count']}")
 
         # Formats
         if "res_format" in facets:
             lines.append("\n### Haeufigste Formate")
-            fmts = facets["res_format"]
-            if isinstance(fmts, dict):
-                items = fmts.get("items", [])
-            else:
-                items = fmts if isinstance(fmts, list) else []
-            for item in sorted(items, key=lambda x: x.get("count", 0), reverse=True)[:10]:
-                lines.append(f"- **{item.get('display_name', item.get('name', '?'))}**: {item.get('count', 0)}")
+            for item in _sorted_facet_items(facets["res_format"])[:10]:
+                lines.append(f"- **{item.get('display_name') or item.get('name') or '?'}**: {item['count']}")
 
         return "\n".join(lines)
 
@@ -465,14 +533,14 @@ async def berlin_catalog_stats() -> str:
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 
 
-@mcp.resource("berlin://dataset/{name}")
+@_resource("berlin://dataset/{name}")
 async def get_dataset_resource(name: str) -> str:
     """Datensatz-Metadaten als MCP Resource."""
     result = await ckan_request("package_show", {"id": name})
-    return json.dumps(result, indent=2, ensure_ascii=False, default=str)
+    return orjson.dumps(result, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS, default=str).decode()
 
 
-@mcp.resource("berlin://category/{group_id}")
+@_resource("berlin://category/{group_id}")
 async def get_category_resource(group_id: str) -> str:
     """Kategorie-Details als MCP Resource."""
     result = await ckan_request(
@@ -482,7 +550,7 @@ async def get_category_resource(group_id: str) -> str:
             "include_datasets": True,
         },
     )
-    return json.dumps(result, indent=2, ensure_ascii=False, default=str)
+    return orjson.dumps(result, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS, default=str).decode()
 
 
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
@@ -490,10 +558,24 @@ async def get_category_resource(group_id: str) -> str:
 # ━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━━
 
 
+async def _serve(mcp: "FastMCP", transport: str) -> None:
+    """Run the server on the given transport and close the shared HTTP client on shutdown."""
+    if transport not in ("stdio", "sse", "streamable-http"):
+        raise ValueError(f"Unknown transport: {transport}")
+    # Looked up by name: older mcp releases lack run_streamable_http_async
+    runner = getattr(mcp, f"run_{transport.replace('-', '_')}_async", None)
+    if runner is None:
+        raise ValueError(f"Transport '{transport}' is not supported by the installed mcp version")
+    try:
+        await runner()
+    finally:
+        await close_client()
+
+
 def main():
     """Start the Berlin Open Data MCP server."""
     transport = os.environ.get("MCP_TRANSPORT", "stdio")
-    mcp.run(transport=transport)
+    asyncio.run(_serve(create_server(), transport))
 
 
 if __name__ == "__main__":
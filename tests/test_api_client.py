@@ -0,0 +1,223 @@
+"""
+Offline tests for the CKAN client in api_client.py.
+All requests go to an httpx.MockTransport, no network access needed.
+"""
+
+import asyncio
+import gc
+import logging
+import sys
+
+# Add src to path
+sys.path.insert(0, "src")
+
+import httpx
+import pytest
+
+from berlin_opendata_mcp import api_client
+from berlin_opendata_mcp.api_client import ckan_batch, ckan_request, clear_cache, close_client, http_get_json
+
+
+class FakeCKAN:
+    """Mock CKAN handler that records every request it receives."""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.requests: list[httpx.Request] = []
+        self.in_flight = 0
+        self.peak = 0
+
+    async def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.requests.append(request)
+        self.in_flight += 1
+        self.peak = max(self.peak, self.in_flight)
+        try:
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            return await self._respond(request)
+        finally:
+            self.in_flight -= 1
+
+    async def _respond(self, request: httpx.Request) -> httpx.Response:
+        action = request.url.path.rsplit("/", 1)[-1]
+        if action == "slow":
+            await asyncio.sleep(float(request.url.params["delay"]))
+        if action == "fail":
+            return httpx.Response(200, json={"success": False, "error": {"message": "kaputt"}})
+        return httpx.Response(200, json={"success": True, "result": {"url": str(request.url)}})
+
+
+def use_transport(handler) -> None:
+    """Point the shared client at a mock transport for the running event loop."""
+    api_client._client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    api_client._client_loop = asyncio.get_running_loop()
+    api_client._request_slots = asyncio.Semaphore(api_client.MAX_CONCURRENT_REQUESTS)
+
+
+@pytest.fixture(autouse=True)
+async def _reset_client_state():
+    clear_cache()
+    yield
+    await close_client()
+    clear_cache()
+
+
+# ─── Response Cache ───────────────────────────────────────────────────────────
+
+
+async def test_repeated_call_is_served_from_cache():
+    ckan = FakeCKAN()
+    use_transport(ckan)
+    first = await ckan_request("package_show", {"id": "kurse"})
+    second = await ckan_request("package_show", {"id": "kurse"})
+    assert first == second
+    assert len(ckan.requests) == 1
+
+
+async def test_bypass_cache_queries_ckan_again():
+    ckan = FakeCKAN()
+    use_transport(ckan)
+    await ckan_request("package_show", {"id": "kurse"})
+    await ckan_request("package_show", {"id": "kurse"}, bypass_cache=True)
+    assert len(ckan.requests) == 2
+
+
+async def test_expired_entry_is_fetched_again(monkeypatch):
+    monkeypatch.setattr(api_client, "CACHE_TTL", -1.0)
+    ckan = FakeCKAN()
+    use_transport(ckan)
+    await ckan_request("package_show", {"id": "kurse"})
+    await ckan_request("package_show", {"id": "kurse"})
+    assert len(ckan.requests) == 2
+
+
+async def test_list_params_are_sent_repeated_and_cached():
+    ckan = FakeCKAN()
+    use_transport(ckan)
+    await ckan_request("package_search", {"fq": ["a", "b"]})
+    await ckan_request("package_search", {"fq": ["a", "b"]})
+    assert len(ckan.requests) == 1
+    assert ckan.requests[0].url.params.get_list("fq") == ["a", "b"]
+
+
+async def test_unhashable_params_skip_cache():
+    ckan = FakeCKAN()
+    use_transport(ckan)
+    await ckan_request("package_search", {"fq": {"groups": "bildung"}})
+    await ckan_request("package_search", {"fq": {"groups": "bildung"}})
+    assert len(ckan.requests) == 2
+    assert not api_client._cache
+
+
+async def test_errors_are_not_cached():
+    ckan = FakeCKAN()
+    use_transport(ckan)
+    for _ in range(2):
+        with pytest.raises(RuntimeError, match="kaputt"):
+            await ckan_request("fail")
+    assert len(ckan.requests) == 2
+
+
+async def test_oldest_entry_is_evicted_at_maxsize(monkeypatch):
+    monkeypatch.setattr(api_client, "CACHE_MAXSIZE", 2)
+    ckan = FakeCKAN()
+    use_transport(ckan)
+    for dataset_id in ("a", "b", "c"):
+        await ckan_request("package_show", {"id": dataset_id})
+    assert len(api_client._cache) == 2
+
+    await ckan_request("package_show", {"id": "c"})
+    assert len(ckan.requests) == 3
+    await ckan_request("package_show", {"id": "a"})
+    assert len(ckan.requests) == 4
+
+
+# ─── Request Coalescing ───────────────────────────────────────────────────────
+
+
+async def test_concurrent_identical_requests_share_one_fetch():
+    ckan = FakeCKAN(delay=0.05)
+    use_transport(ckan)
+    results = await asyncio.gather(*(ckan_request("package_show", {"id": "kurse"}) for _ in range(5)))
+    assert len(ckan.requests) == 1
+    assert all(r is results[0] for r in results)
+
+
+async def test_cancelled_waiter_does_not_cancel_shared_fetch():
+    ckan = FakeCKAN(delay=0.05)
+    use_transport(ckan)
+    first = asyncio.ensure_future(ckan_request("package_show", {"id": "kurse"}))
+    second = asyncio.ensure_future(ckan_request("package_show", {"id": "kurse"}))
+    await asyncio.sleep(0.01)
+    first.cancel()
+
+    result = await second
+    assert "kurse" in result["url"]
+    assert first.cancelled()
+    assert len(ckan.requests) == 1
+
+
+async def test_failed_shared_fetch_raises_in_every_waiter():
+    ckan = FakeCKAN(delay=0.05)
+    use_transport(ckan)
+    results = await asyncio.gather(*(ckan_request("fail") for _ in range(3)), return_exceptions=True)
+    assert len(ckan.requests) == 1
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert not api_client._pending
+
+
+async def test_orphaned_failed_fetch_logs_no_unretrieved_exception(caplog):
+    ckan = FakeCKAN(delay=0.05)
+    use_transport(ckan)
+    waiter = asyncio.ensure_future(ckan_request("fail"))
+    await asyncio.sleep(0.01)
+    waiter.cancel()
+    await asyncio.sleep(0.1)
+
+    # Drop the last reference to the shared task so its destructor runs now
+    del waiter
+    with caplog.at_level(logging.ERROR, logger="asyncio"):
+        gc.collect()
+    assert "never retrieved" not in caplog.text
+    assert not api_client._pending
+
+
+async def test_ckan_batch_keeps_input_order():
+    ckan = FakeCKAN()
+    use_transport(ckan)
+    # Earlier calls answer more slowly, so completion order is reversed
+    calls = [("slow", {"delay": delay}) for delay in (0.06, 0.03, 0.0)]
+    results = await ckan_batch(calls)
+    assert [r["url"].rsplit("=", 1)[-1] for r in results] == ["0.06", "0.03", "0.0"]
+
+
+async def test_ckan_batch_return_exceptions():
+    ckan = FakeCKAN()
+    use_transport(ckan)
+    calls = [("package_show", {"id": "a"}), ("fail", None), ("package_show", {"id": "b"})]
+    results = await ckan_batch(calls, return_exceptions=True)
+    assert "id=a" in results[0]["url"]
+    assert isinstance(results[1], RuntimeError)
+    assert "id=b" in results[2]["url"]
+
+    with pytest.raises(RuntimeError, match="kaputt"):
+        await ckan_batch(calls)
+
+
+# ─── Concurrency Limit ────────────────────────────────────────────────────────
+
+
+async def test_ckan_requests_respect_concurrency_limit():
+    ckan = FakeCKAN(delay=0.02)
+    use_transport(ckan)
+    await ckan_batch([("package_show", {"id": i}) for i in range(3 * api_client.MAX_CONCURRENT_REQUESTS)])
+    assert len(ckan.requests) == 3 * api_client.MAX_CONCURRENT_REQUESTS
+    assert 1 < ckan.peak <= api_client.MAX_CONCURRENT_REQUESTS
+
+
+async def test_http_get_json_respects_concurrency_limit():
+    ckan = FakeCKAN(delay=0.02)
+    use_transport(ckan)
+    urls = [f"https://example.org/data/{i}.json" for i in range(3 * api_client.MAX_CONCURRENT_REQUESTS)]
+    await asyncio.gather(*(http_get_json(url) for url in urls))
+    assert 1 < ckan.peak <= api_client.MAX_CONCURRENT_REQUESTS
@@ -9,6 +9,10 @@ import sys
 # Add src to path
 sys.path.insert(0, "src")
 
+import pytest
+from pydantic import ValidationError
+
+from berlin_opendata_mcp.api_client import close_client
 from berlin_opendata_mcp.server import (
     AnalyzeDatasetInput,
     GetDatasetInput,
@@ -24,6 +28,13 @@ from berlin_opendata_mcp.server import (
 )
 
 
+@pytest.fixture(autouse=True)
+async def _close_shared_client():
+    """pytest runs each test in its own event loop; close the shared client before that loop ends."""
+    yield
+    await close_client()
+
+
 async def test_search():
     print("=" * 60)
     print("TEST 1: berlin_search_datasets('Einwohner')")
@@ -95,6 +106,32 @@ async def test_catalog_stats():
     print("PASSED\n")
 
 
+async def test_invalid_group():
+    print("=" * 60)
+    print("TEST 8: unbekannte Kategorie wird ohne API-Aufruf abgelehnt")
+    print("=" * 60)
+    for make_input in (
+        lambda: SearchDatasetsInput(query="Einwohner", filter_group="gibtsnicht"),
+        lambda: ListGroupInput(group_id="gibtsnicht"),
+    ):
+        try:
+            make_input()
+        except ValidationError as e:
+            assert "Unbekannte Kategorie" in str(e)
+        else:
+            raise AssertionError("ValidationError erwartet")
+
+    # Leere Gruppen-ID bedeutet "alle Kategorien auflisten" bzw. "kein Filter"
+    assert ListGroupInput(group_id="").group_id is None
+    assert ListGroupInput(group_id="  ").group_id is None
+    assert SearchDatasetsInput(query="Einwohner", filter_group="").filter_group is None
+
+    # Gross-/Kleinschreibung wird normalisiert
+    assert ListGroupInput(group_id="Bildung").group_id == "bildung"
+    assert SearchDatasetsInput(query="Einwohner", filter_group="Bildung").filter_group == "bildung"
+    print("PASSED\n")
+
+
 async def main():
     print("\nBerlin Open Data MCP Server – Integration Tests\n")
 
@@ -106,18 +143,18 @@ async def main():
         test_tags,
         test_analyze,
         test_catalog_stats,
+        test_invalid_group,
     ]
 
-    passed = 0
-    failed = 0
+    # Run concurrently over the shared HTTP client; test output may interleave
+    results = await asyncio.gather(*(t() for t in tests), return_exceptions=True)
+    for test, result in zip(tests, results):
+        if isinstance(result, Exception):
+            print(f"FAILED {test.__name__}: {result}\n")
+    passed = sum(1 for r in results if not isinstance(r, Exception))
+    failed = len(results) - passed
 
-    for test in tests:
-        try:
-            await test()
-            passed += 1
-        except Exception as e:
-            print(f"FAILED: {e}\n")
-            failed += 1
+    await close_client()
 
     print("=" * 60)
     print(f"Ergebnis: {passed} bestanden, {failed} fehlgeschlagen von {len(tests)}")